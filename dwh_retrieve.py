@@ -7,9 +7,14 @@ Date: 27/12/2022.
 
 # Standard library
 import datetime as dt
+import json
+import os
 import pprint
 import subprocess  # use: run command line commands from python
 import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
 
 # Third-party
@@ -146,6 +151,111 @@ def parse_vars(vars, device):
     return vars_str
 
 
+def termin2datetime(termin):
+    """Convert timestamps of retrieve_cscs to datetime.
+
+    The format is detected once from the first timestamp. Timestamps
+    of digits only (YYYYmmddHH[MM[SS]]) are converted arithmetically,
+    which is much faster than parsing them as strings.
+
+    Args:
+        termin  (pandas series):    timestamps as strings
+
+    Returns:
+        pandas series of datetime64
+
+    """
+    first = termin.iloc[0] if len(termin) else ""
+    if not (first.isdigit() and len(first) in (10, 12, 14)):
+        return pd.to_datetime(termin)
+
+    # pad to YYYYmmddHHMMSS
+    digits = termin.astype(np.int64) * 10 ** (14 - len(first))
+
+    return pd.to_datetime(
+        pd.DataFrame(
+            {
+                "year": digits // 10**10,
+                "month": digits // 10**8 % 100,
+                "day": digits // 10**6 % 100,
+                "hour": digits // 10**4 % 100,
+                "minute": digits // 100 % 100,
+                "second": digits % 100,
+            }
+        )
+    )
+
+
+def dwh_dtypes():
+    """Column dtypes of retrieve_cscs output: all DWH IDs in vdf are floats."""
+    dtypes = {}
+    for dwh_ids in vdf.loc["dwh_id"]:
+        if isinstance(dwh_ids, dict):
+            dtypes.update(dict.fromkeys(dwh_ids.values(), np.float64))
+
+    return dtypes
+
+
+def parse_dwh_output(out):
+    """Parse the output of retrieve_cscs in one pass.
+
+    The output consists of a header line with the column names, a
+    separator line, records separated by '|' and 2 footer lines.
+    Header and footer are stripped here, so the records can be
+    parsed by the C engine.
+
+    Args:
+        out     (str):  stdout of retrieve_cscs
+
+    Returns:
+        pandas dataframe (None if no records were read)
+
+    """
+    lines = out.split("\n", 2)
+    names = lines[0].split()
+
+    if " ".join(names[:3]) == "records read: 0":
+        return None
+
+    # strip the 2 footer lines
+    body = lines[2] if len(lines) > 2 else ""
+    if body.endswith("\n"):
+        body = body[:-1]
+    body = body.rsplit("\n", 2)[0] if body.count("\n") >= 2 else ""
+
+    return parse_records(body, names)
+
+
+def parse_records(body, names):
+    """Parse records of retrieve_cscs output (without header and footer).
+
+    Args:
+        body    (str):  records separated by '|', one per line
+        names   (list): column names from the header line
+
+    Returns:
+        pandas dataframe
+
+    """
+    dtypes = {
+        name: dtype for name, dtype in dwh_dtypes().items() if name in names
+    }
+    dtypes["termin"] = str
+
+    data = pd.read_csv(
+        StringIO(body),
+        sep="|",
+        header=None,
+        names=names,
+        dtype=dtypes,
+        engine="c",
+    )
+
+    data["termin"] = termin2datetime(data["termin"].str.strip())
+
+    return data
+
+
 def dwh2pandas(cmd, verbose):
     """Run retrieve_cscs command in terminal, create pandas dataframe."""
     if verbose:
@@ -168,32 +278,14 @@ def dwh2pandas(cmd, verbose):
     if proc.returncode != 0:
         raise SystemExit(err)
 
-    # load DWH retrieve output
-    header_line = pd.read_csv(
-        StringIO(out), skiprows=0, nrows=1, sep="\s+", header=None, engine="c"
-    )
-
-    check = (
-        f"{header_line[0].iloc[0]} {header_line[1].iloc[0]} {header_line[2].iloc[0]}"
-    )
-    if check == "records read: 0":
+    # parse the command line output into pandas dataframe
+    data = parse_dwh_output(out)
+    if data is None:
         print(
             f"--- WARNING: For the given time period, location and/or device, no data could be retrieved. Returning empty dataframe."
         )
         return pd.DataFrame()
 
-    # parse the command line output into pandas dataframe
-    data = pd.read_csv(
-        StringIO(out),
-        skiprows=2,
-        skipfooter=2,
-        sep="|",
-        header=None,
-        names=header_line.values.astype(str)[0, :],
-        engine="python",
-        parse_dates=["termin"],
-    )
-
     # check if no data is available for the time period
     if data.empty:
         # TODO: Code should not break but return empty dataframe
@@ -217,20 +309,80 @@ def dwh2pandas(cmd, verbose):
     return data
 
 
-def dwh_surface(station_name, vars_str, start, end, verbose=False):
+def dwh2pandas_chunks(cmd, verbose, chunksize=100000):
+    """Run retrieve_cscs command in terminal, yield dataframes of chunksize records.
+
+    The output is read from the pipe while the command is running and
+    parsed chunk by chunk, so memory is bounded by the chunk size
+    instead of the size of the whole output.
+
+    Args:
+        cmd         (str):  retrieve_cscs command
+        verbose     (bool): verbose statements
+        chunksize   (int):  records per dataframe
+
+    Yields:
+        pandas dataframe
+
+    """
+    if verbose:
+        print("Calling: " + cmd)
+
+    with tempfile.TemporaryFile("w+") as err, subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=err,
+        universal_newlines=True,
+        shell=True,
+    ) as proc:
+        names = proc.stdout.readline().split()
+
+        if " ".join(names[:3]) == "records read: 0":
+            print(
+                f"--- WARNING: For the given time period, location and/or device, no data could be retrieved."
+            )
+        else:
+            # skip separator line
+            proc.stdout.readline()
+
+            # hold back the last 2 lines, they are the footer
+            footer = deque()
+            records = []
+            for line in proc.stdout:
+                footer.append(line)
+                if len(footer) > 2:
+                    records.append(footer.popleft())
+                if len(records) == chunksize:
+                    yield parse_records("".join(records), names).replace(1e7, np.nan)
+                    records = []
+
+            if records:
+                yield parse_records("".join(records), names).replace(1e7, np.nan)
+
+        if proc.wait() != 0:
+            err.seek(0)
+            raise SystemExit(err.read())
+
+
+def dwh_surface(station_name, vars_str, start, end, verbose=False, chunksize=None):
     """Retrieve surface-based data from DWH.
 
     Args:
-        station_name    (str):  DWH station name
+        station_name    (str):  DWH station name (or list of names, comma-separated)
         vars_str        (str):  DWH IDs of variables, separated by comma
         start           (str):  YYYYmmddHH
         end             (str):  YYYYmmddHH (same or later as <start>)
         verbose         (bool): verbose statements
+        chunksize       (int):  stream the output in dataframes of chunksize
+                                records (optional)
 
     Returns:
-        pandas dataframe:   DWH surface data
+        pandas dataframe:   DWH surface data (generator of dataframes if chunksize)
 
     """
+    if isinstance(station_name, list):
+        station_name = ",".join(station_name)
+
     if verbose:
         print(f"Retrieving surface-based data for:")
         print(f"  {vars_str}")
@@ -239,7 +391,7 @@ def dwh_surface(station_name, vars_str, start, end, verbose=False):
 
     # retrieve_cscs command:
     cmd = (
-        "/oprusers/osm/bin/retrieve_cscs --show_records -j lat,lon,name,wmo_ind"
+        "/oprusers/osm/bin/retrieve_cscs --show_records -j lat,lon,name,wmo_ind,nat_abr"
         + " -s surface "
         + " -i nat_abr,"
         + station_name
@@ -253,25 +405,34 @@ def dwh_surface(station_name, vars_str, start, end, verbose=False):
     )
 
     # run command
+    if chunksize is not None:
+        return dwh2pandas_chunks(cmd, verbose, chunksize)
     data = dwh2pandas(cmd, verbose)
 
     return data
 
 
-def dwh_profile(device, station_id, vars_str, start, end, verbose=False):
+def dwh_profile(
+    device, station_id, vars_str, start, end, verbose=False, chunksize=None
+):
     """Retrieve profile-based data from DWH.
 
     Args:
-        station_id  (str):  DWH ID of station (number as string!)
+        station_id  (str):  DWH ID of station (number as string!) or list of IDs
         vars_str    (str):  DWH IDs of variables, separated by comma
         start       (str):  YYYYmmddHH
         end         (str):  YYYYmmddHH (same or later as <start>)
         verbose     (bool): verbose statements
+        chunksize   (int):  stream the output in dataframes of chunksize
+                            records (optional)
 
     Returns:
-        pandas dataframe:   DWH profile data
+        pandas dataframe:   DWH profile data (generator of dataframes if chunksize)
 
     """
+    if isinstance(station_id, list):
+        station_id = ",".join(station_id)
+
     if verbose:
         print(f"Retrieving profile-based data for:")
         print(f"  {vars_str}")
@@ -300,43 +461,117 @@ def dwh_profile(device, station_id, vars_str, start, end, verbose=False):
         sys.exit(1)
 
     # run command
+    if chunksize is not None:
+        return dwh2pandas_chunks(cmd, verbose, chunksize)
     data = dwh2pandas(cmd, verbose)
 
     return data
 
 
-def dwh_retrieve(device, station, vars, timestamps, verbose=False):
-    """Retrieve observational data from DWH.
+def station_key(device):
+    """Column of retrieve_cscs output and sdf attribute which identify a station.
 
-    The retrieve_cscs command works for two different observational types:
-        a) surface-based data (2m stations including ceilometers & scintillometers)
-        b) profile-based data (radiosoundings - 'rs', radiometers - 'mwr')
+    Surface data is queried by national abbreviation (dwh_name),
+    profile data by WMO index (dwh_id).
+    """
+    if device in ["rs", "mwr"]:
+        return "wmo_ind", "dwh_id"
+    return "nat_abr", "dwh_name"
 
-    Input:
-        device      string              measurement device: 'rs', 'mwr', 'cm', ...
-        station     string              station short name
-        vars        list of strings     variables
-        timestamps  list of strings     either 1 or 2 timestamps YYYYmmddHH
 
-    Output:
-        pandas dataframe
-    """
-    # parse timestamp input to 2 string of format YYYYmmddHH
-    t1, t2 = parse_timestamps(timestamps)
+def split_stations(raw_data, station, relevant_vars, device):
+    """Keep relevant columns, add station column for multi-station retrieves."""
+    if not isinstance(station, list):
+        return raw_data[relevant_vars]
 
-    # create tuple of variables if only 1 variable is given
-    if isinstance(vars, str):
-        vars = (vars,)
+    column, attr = station_key(device)
+    keys = {getattr(sdf[st], attr): st for st in station}
+    if column == "wmo_ind":
+        keys = {int(key): st for key, st in keys.items()}
+        values = pd.to_numeric(raw_data[column], errors="coerce")
+    else:
+        values = raw_data[column].astype(str).str.strip()
+    raw_data["station"] = values.map(keys)
+
+    return raw_data[relevant_vars + ["station"]]
+
+
+def station_batches(stations, batch_size, device):
+    """Split stations into batches which can be told apart in the output."""
+    _, attr = station_key(device)
+    batches = []
+    for station in stations:
+        for batch in batches:
+            if len(batch) < batch_size and all(
+                getattr(sdf[st], attr) != getattr(sdf[station], attr) for st in batch
+            ):
+                batch.append(station)
+                break
+        else:
+            batches.append([station])
+
+    return batches
+
+
+def rename_columns(raw_data, device, station, vars):
+    """Rename DWH IDs to short names and keep the relevant columns."""
+    # rename column names to nice short names and
+    #  make list of relevant columns
+    raw_data.rename(columns={"termin": "timestamp"}, inplace=True)
+    relevant_vars = [
+        "timestamp",
+    ]
+    if device in ["rs", "mwr"]:
+        relevant_vars.append("altitude")
+
+    # renaming columns of variable(s)
+    for var in vars:
+        dwh_id = vdf[var].dwh_id[device]
+        short_name = vdf[var].short_name
+        raw_data.rename(columns={dwh_id: short_name}, inplace=True)
+        relevant_vars.append(short_name)
+
+    # rename altitude-column
+    if device == "rs":
+        raw_data.rename(columns={"742": "altitude"}, inplace=True)
+    elif device == "mwr":
+        raw_data.rename(columns={"level": "altitude"}, inplace=True)
+
+    return split_stations(raw_data, station, relevant_vars, device)
+
+
+def retrieve_long(device, station, vars, start, end, verbose=False, chunksize=None):
+    """Retrieve observational data from DWH in long format.
 
+    Several stations are retrieved with one retrieve_cscs call and
+    told apart by their national abbreviation (surface, dwh_name in sdf)
+    or WMO index (profiles, dwh_id in sdf).
+
+    Args:
+        device      (str):      measurement device: 'rs', 'mwr', 'cm', ...
+        station     (str):      station short name (or list of names)
+        vars        (tuple):    variables
+        start       (str):      YYYYmmddHH
+        end         (str):      YYYYmmddHH (same or later as <start>)
+        verbose     (bool):     verbose statements
+        chunksize   (int):      stream the output in dataframes of chunksize
+                                records (optional)
+
+    Returns:
+        pandas dataframe:   one row per timestamp (and altitude for profiles),
+                            column 'station' if a list of stations is given
+                            (generator of dataframes if chunksize)
+
+    """
     # prepare string of DWH IDs for variable(s)
     vars_str = parse_vars(vars, device)
 
-    if verbose:
-        print(f"Calling dwh retrieve command:")
-        print(f"  device: {device}")
-        print(f"  station: {station}")
-        print(f"  variables: {vars}")
-        print(f"  timestamps: {t1}, {t2}")
+    if isinstance(station, list):
+        station_ids = [sdf[st].dwh_id for st in station]
+        station_names = [sdf[st].dwh_name for st in station]
+    else:
+        station_ids = sdf[station].dwh_id
+        station_names = sdf[station].dwh_name
 
     # profile-based data
     if device in ["rs", "mwr"]:
@@ -344,38 +579,181 @@ def dwh_retrieve(device, station, vars, timestamps, verbose=False):
         # call dwh retrieve for profile-based data
         raw_data = dwh_profile(
             device=device,
-            station_id=sdf[station].dwh_id,
+            station_id=station_ids,
             vars_str=vars_str,
-            start=t1,
-            end=t2,
+            start=start,
+            end=end,
             verbose=verbose,
+            chunksize=chunksize,
         )
 
-        if raw_data.empty:
-            return raw_data
+    # surface-based data
+    elif device in ["5cm", "2m", "2m_tower", "10m_tower", "30m_tower"]:
 
-        # rename column names to nice short names and
-        #  make list of relevant columns
-        raw_data.rename(columns={"termin": "timestamp"}, inplace=True)
-        relevant_vars = [
-            "timestamp",
-            "altitude",
-        ]
+        # call dwh retrieve for surface-based data
+        raw_data = dwh_surface(
+            station_name=station_names,
+            vars_str=vars_str,
+            start=start,
+            end=end,
+            verbose=verbose,
+            chunksize=chunksize,
+        )
+
+    else:
+        print("! unknown device!")
+        sys.exit(1)
+
+    if chunksize is not None:
+        return (rename_columns(chunk, device, station, vars) for chunk in raw_data)
+
+    if raw_data.empty:
+        return raw_data
+
+    return rename_columns(raw_data, device, station, vars)
+
+
+def str2timestamp(ts):
+    """Convert YYYYmmddHH or YYYYmmddHHMM string to pandas timestamp."""
+    if len(ts) == 12:
+        return pd.to_datetime(ts, format="%Y%m%d%H%M")
+    return pd.to_datetime(ts, format="%Y%m%d%H")
 
-        # renaming columns of variable(s)
-        for var in vars:
-            dwh_id = vdf[var].dwh_id[device]
-            short_name = vdf[var].short_name
-            raw_data.rename(columns={dwh_id: short_name}, inplace=True)
-            relevant_vars.append(short_name)
 
-        # rename altitude-column
-        if device == "rs":
-            raw_data.rename(columns={"742": "altitude"}, inplace=True)
+def missing_intervals(covered, start, end):
+    """Find sub-ranges of [start, end] which are not covered yet.
+
+    Intervals are closed, the returned sub-ranges include the boundaries
+    of neighbouring covered intervals (duplicates have to be dropped).
+
+    Args:
+        covered     (list):         (start, end) tuples of pandas timestamps
+        start       (timestamp):    start of requested range
+        end         (timestamp):    end of requested range
+
+    Returns:
+        list of (start, end) tuples
+
+    """
+    missing = []
+    touched = False
+    for t1, t2 in sorted(covered):
+        if t2 < start or t1 > end:
+            continue
+        if t1 > start:
+            missing.append((start, t1))
+        start = max(start, t2)
+        touched = True
+
+    if not touched:
+        return [(start, end)]
+    if start < end:
+        missing.append((start, end))
+
+    return missing
+
+
+def merge_intervals(intervals):
+    """Merge overlapping closed intervals."""
+    merged = []
+    for t1, t2 in sorted(intervals):
+        if merged and t1 <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], t2))
         else:
-            raw_data.rename(columns={"level": "altitude"}, inplace=True)
+            merged.append((t1, t2))
 
-        data = raw_data[relevant_vars]
+    return merged
+
+
+# observations younger than this may not be ingested in DWH yet,
+#  so they are not marked as retrieved in the cache
+DWH_LATENCY = pd.Timedelta(hours=6)
+
+
+def cached_retrieve(device, station, vars, t1, t2, cache_dir, verbose=False):
+    """Retrieve observational data from DWH through a local cache.
+
+    Results are stored per device, station and variables in a
+    parquet file together with the time intervals already retrieved.
+    Only the sub-ranges which are not covered yet are requested from DWH.
+    Data younger than DWH_LATENCY is not marked as covered, since
+    observations may not be ingested yet.
+
+    Args:
+        device      (str):      measurement device: 'rs', 'mwr', 'cm', ...
+        station     (str):      station short name
+        vars        (tuple):    variables
+        t1          (str):      YYYYmmddHH
+        t2          (str):      YYYYmmddHH (same or later as <t1>)
+        cache_dir   (str):      cache directory
+        verbose     (bool):     verbose statements
+
+    Returns:
+        pandas dataframe:   same as retrieve_long
+
+    """
+    # toolbox is only needed (and imported) for the cache
+    from plot_profile.utils.toolbox import write_atomic
+
+    dwh_ids = sorted(vdf[var].dwh_id[device] for var in vars)
+    path = os.path.join(cache_dir, device, station, "_".join(dwh_ids))
+    os.makedirs(path, exist_ok=True)
+    data_file = os.path.join(path, "data.parquet")
+    intervals_file = os.path.join(path, "intervals.json")
+
+    fmt = "%Y%m%d%H%M" if len(t1) == 12 else "%Y%m%d%H"
+    start, end = str2timestamp(t1), str2timestamp(t2)
+
+    covered = []
+    if os.path.exists(intervals_file):
+        with open(intervals_file) as f:
+            covered = [(pd.Timestamp(a), pd.Timestamp(b)) for a, b in json.load(f)]
+    cached = pd.read_parquet(data_file) if os.path.exists(data_file) else pd.DataFrame()
+
+    missing = missing_intervals(covered, start, end)
+    if verbose:
+        print(f"Cache covers {covered}, retrieving {missing}.")
+
+    if missing:
+        new = [
+            retrieve_long(
+                device, station, vars, a.strftime(fmt), b.strftime(fmt), verbose
+            )
+            for a, b in missing
+        ]
+        cached = pd.concat([cached] + new, ignore_index=True)
+        if not cached.empty:
+            keys = [col for col in ("timestamp", "altitude") if col in cached.columns]
+            # re-retrieved rows are newer, they replace the cached ones
+            cached = cached.drop_duplicates(subset=keys, keep="last").sort_values(keys)
+            cached = cached.reset_index(drop=True)
+
+        if not cached.empty:
+            write_atomic(data_file, lambda f: cached.to_parquet(f, index=False))
+
+        # recent data may still be ingested, retrieve it again next time
+        cutoff = pd.Timestamp.now("UTC").tz_localize(None) - DWH_LATENCY
+        retrieved = [(a, min(b, cutoff)) for a, b in missing if a <= cutoff]
+        covered = merge_intervals(covered + retrieved)
+        intervals = json.dumps([(str(a), str(b)) for a, b in covered])
+        write_atomic(intervals_file, lambda f: f.write(intervals.encode()))
+
+    if cached.empty:
+        return cached
+
+    in_range = (cached.timestamp >= start) & (cached.timestamp <= end)
+
+    return cached[in_range].reset_index(drop=True)
+
+
+def arrange_output(data, device, vars, t1, t2):
+    """Rearrange profiles for multiple timestamps into altitude x timestamp."""
+    # e.g. stations without records in a multi-station retrieve
+    if data.empty:
+        return data
+
+    # profile-based data
+    if device in ["rs", "mwr"]:
 
         # case A) only 1 timestamp specified for profile data
         if t1 == t2:
@@ -389,6 +767,7 @@ def dwh_retrieve(device, station, vars, timestamps, verbose=False):
                 )
                 sys.exit(1)
             else:
+                var = vdf[vars[0]].short_name
 
                 # print warning
                 print(
@@ -412,39 +791,147 @@ def dwh_retrieve(device, station, vars, timestamps, verbose=False):
                 return new_df
 
     # surface-based data
-    elif device in ["5cm", "2m", "2m_tower", "10m_tower", "30m_tower"]:
+    return data
 
-        # call dwh retrieve for surface-based data
-        raw_data = dwh_surface(
-            station_name=sdf[station].dwh_name,
-            vars_str=vars_str,
-            start=t1,
-            end=t2,
-            verbose=verbose,
-        )
 
-        if raw_data.empty:
-            return raw_data
+def dwh_retrieve(
+    device, station, vars, timestamps, verbose=False, cache_dir=None, chunksize=None
+):
+    """Retrieve observational data from DWH.
 
-        # rename column names to nice short names and
-        #  make list of relevant columns
-        raw_data.rename(columns={"termin": "timestamp"}, inplace=True)
-        relevant_vars = [
-            "timestamp",
-        ]
-        for var in vars:
-            dwh_id = vdf[var].dwh_id[device]
-            short_name = vdf[var].short_name
-            raw_data.rename(columns={dwh_id: short_name}, inplace=True)
-            relevant_vars.append(short_name)
+    The retrieve_cscs command works for two different observational types:
+        a) surface-based data (2m stations including ceilometers & scintillometers)
+        b) profile-based data (radiosoundings - 'rs', radiometers - 'mwr')
+
+    Input:
+        device      string              measurement device: 'rs', 'mwr', 'cm', ...
+        station     string              station short name
+        vars        list of strings     variables
+        timestamps  list of strings     either 1 or 2 timestamps YYYYmmddHH
+        cache_dir   string              local cache, only missing time ranges
+                                        are retrieved from DWH (optional)
+        chunksize   int                 stream the output in dataframes of chunksize
+                                        records in long format, profiles are not
+                                        rearranged (optional, not with cache_dir)
 
-        data = raw_data[relevant_vars]
+    Output:
+        pandas dataframe (generator of dataframes if chunksize)
+    """
+    # parse timestamp input to 2 string of format YYYYmmddHH
+    t1, t2 = parse_timestamps(timestamps)
 
+    # create tuple of variables if only 1 variable is given
+    if isinstance(vars, str):
+        vars = (vars,)
+
+    if verbose:
+        print(f"Calling dwh retrieve command:")
+        print(f"  device: {device}")
+        print(f"  station: {station}")
+        print(f"  variables: {vars}")
+        print(f"  timestamps: {t1}, {t2}")
+
+    if chunksize is not None:
+        if cache_dir is not None:
+            raise ValueError("Streaming with chunksize is not supported with cache_dir.")
+        return retrieve_long(device, station, vars, t1, t2, verbose, chunksize)
+
+    if cache_dir is None:
+        data = retrieve_long(device, station, vars, t1, t2, verbose)
+    else:
+        data = cached_retrieve(device, station, vars, t1, t2, cache_dir, verbose)
+
+    if data.empty:
         return data
 
+    return arrange_output(data, device, vars, t1, t2)
+
+
+def dwh_retrieve_many(
+    device,
+    stations,
+    vars,
+    timestamps,
+    max_workers=8,
+    batch_size=20,
+    verbose=False,
+    cache_dir=None,
+):
+    """Retrieve observational data of many stations from DWH concurrently.
+
+    Up to batch_size stations are retrieved with one retrieve_cscs call
+    and split up again (see station_key). The batches run in threads,
+    at most max_workers retrieve_cscs processes at the same time.
+    With a cache, every station is retrieved through the cache on its own.
+
+    Input:
+        device      string              measurement device: 'rs', 'mwr', 'cm', ...
+        stations    list of strings     station short names (None: all stations in sdf)
+        vars        list of strings     variables
+        timestamps  list of strings     either 1 or 2 timestamps YYYYmmddHH
+        max_workers int                 number of concurrent retrievals
+        batch_size  int                 stations per retrieve_cscs call
+        cache_dir   string              local cache, see dwh_retrieve (optional)
+
+    Output:
+        pandas dataframe with additional column 'station'
+    """
+    if stations is None:
+        stations = list(sdf.columns)
+
+    if cache_dir is not None or batch_size == 1:
+        with ThreadPoolExecutor(max_workers) as pool:
+            frames = list(
+                pool.map(
+                    lambda station: dwh_retrieve(
+                        device, station, vars, timestamps, verbose, cache_dir
+                    ),
+                    stations,
+                )
+            )
+
     else:
-        print("! unknown device!")
-        sys.exit(1)
+        t1, t2 = parse_timestamps(timestamps)
+        if isinstance(vars, str):
+            vars = (vars,)
+
+        with ThreadPoolExecutor(max_workers) as pool:
+            batches = list(
+                pool.map(
+                    lambda batch: retrieve_long(device, batch, vars, t1, t2, verbose),
+                    station_batches(stations, batch_size, device),
+                )
+            )
+
+        data = pd.concat(batches)
+        frames = [
+            arrange_output(
+                data[data.station == station].drop(columns="station"),
+                device,
+                vars,
+                t1,
+                t2,
+            )
+            if "station" in data.columns
+            else pd.DataFrame()
+            for station in stations
+        ]
+
+    frames = [
+        frame.assign(station=station)
+        for station, frame in zip(stations, frames)
+        if not frame.empty
+    ]
+    if not frames:
+        return pd.DataFrame()
+
+    data = pd.concat(frames)
+
+    # long format: index carries no information
+    if "timestamp" in data.columns:
+        data.reset_index(drop=True, inplace=True)
+
+    return data
 
 
 if __name__ == "__main__":
@@ -1,44 +1,560 @@
 import numpy as np
 import datetime as dt
+import glob
+import hashlib
+import json
+import os
+import pickle
 import sys
-import matplotlib.path as mpath
+import tempfile
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
 import xarray as xr
-import six
-import psyplot.project as psy
+from scipy import sparse
+from scipy.spatial import cKDTree
 
-def ind_from_latlon(lats,lons,lat,lon,verbose=False):
+# mean earth radius as used in ICON [km]
+EARTH_RADIUS = 6371.229
+
+def latlon_to_xyz(lats, lons):
+    """Convert latitudes and longitudes to cartesian coordinates on the unit sphere.
+
+    Args:
+        lats (float or array):  Latitudes in degrees
+        lons (float or array):  Longitudes in degrees
+
+    Returns:
+        np.array of shape (..., 3)
+    """
+    lats = np.deg2rad(np.asarray(lats, dtype=np.float64))
+    lons = np.deg2rad(np.asarray(lons, dtype=np.float64))
+    cos_lats = np.cos(lats)
+
+    return np.stack(
+        [cos_lats * np.cos(lons), cos_lats * np.sin(lons), np.sin(lats)], axis=-1
+    )
+
+def chord_to_km(chord):
+    """Convert chord lengths on the unit sphere to great-circle distances in km."""
+    return 2 * EARTH_RADIUS * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+def build_grid_index(lats, lons):
+    """Build a spatial index for nearest neighbour lookups on a grid.
+
+    The grid points are placed on the unit sphere, so the euclidean
+    distance in the tree is monotonic in the great-circle distance and
+    lookups are correct at high latitudes and across the dateline.
+
+    Args:
+        lats (array):   Latitudes of grid points in degrees
+        lons (array):   Longitudes of grid points in degrees
+
+    Returns:
+        scipy.spatial.cKDTree   (indices refer to the flattened grid)
+    """
+    return cKDTree(latlon_to_xyz(np.ravel(lats), np.ravel(lons)))
+
+def inds_from_latlon(tree, lat, lon, k=1, return_dist=False):
+    """Find the nearest neighbouring indices for many locations at once.
+
+    Args:
+        tree (cKDTree):             Spatial index from build_grid_index
+        lat (float or array):       Latitude(s) of location(s) in degrees
+        lon (float or array):       Longitude(s) of location(s) in degrees
+        k (int, optional):          Number of neighbours. Defaults to 1.
+        return_dist (bool, optional): Also return distances. Defaults to False.
+
+    Returns:
+        np.array    Indices of nearest grid points, shape of lat (+ k if k > 1)
+        np.array    Great-circle distances in km (only if return_dist)
+    """
+    chord, ind = tree.query(latlon_to_xyz(lat, lon), k=k)
+
+    if return_dist:
+        return ind, chord_to_km(chord)
+    return ind
+
+def ind_from_latlon(lats, lons, lat, lon, verbose=False, tree=None):
     """Find the nearest neighbouring index to given location.
 
+    Distances are great-circle distances. For many lookups on the same
+    grid, pass a tree from build_grid_index or use inds_from_latlon.
+
     Args:
         lats (2d array):            Latitude grid
         lons (2d array):            Longitude grid
         lat (float):                Latitude of location   
         lon (float):                Longitude of location 
         verbose (bool, optional):   Print information. Defaults to False.
+        tree (cKDTree, optional):   Spatial index of the grid. Defaults to None.
 
     Returns:
         int     Index of nearest grid point.
     """
-    dist = [np.sqrt((lats[i]-lat)**2 + (lons[i]-lon)**2) for i in range(len(lats))]
-    ind = np.where(dist==np.min(dist))[0][0]
+    lats = np.ravel(lats)
+    lons = np.ravel(lons)
+
+    if tree is None:
+        # a single vectorized pass is cheaper than building a tree
+        chord2 = np.sum(
+            (latlon_to_xyz(lats, lons) - latlon_to_xyz(lat, lon)) ** 2, axis=-1
+        )
+        ind = int(np.argmin(chord2))
+    else:
+        ind = int(inds_from_latlon(tree, lat, lon))
 
     if verbose:
         print(f'Closest ind: {ind}')
         print(f' Given lat: {lat:.3f} vs found lat: {lats[ind]:.3f}')
-        print(f' Given lat: {lon:.3f} vs found lon: {lons[ind]:.3f}')
+        print(f' Given lon: {lon:.3f} vs found lon: {lons[ind]:.3f}')
 
     return ind
 
-def get_dim_names(ds_var, verbose):
+# directory for cached grid-derived arrays, can be set with $ICON_UTILS_CACHE
+CACHE_DIR = os.environ.get(
+    "ICON_UTILS_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "icon_utils")
+)
+
+# grid ids of files already identified in this process
+_grid_ids = {}
+
+def grid_id(grid):
+    """Identify a grid by its uuidOfHGrid attribute.
+
+    Grids without this attribute are identified by a hash
+    of their cell center coordinates.
+
+    Args:
+        grid (str or xr.Dataset):   icon grid file, opened grid or grid id
+
+    Returns:
+        str
+
+    Raises:
+        FileNotFoundError: if grid looks like a path but is not a file
+    """
+    # strings without path separator or .nc suffix are taken as grid id
+    if isinstance(grid, str) and not os.path.isfile(grid):
+        if os.sep in grid or "/" in grid or grid.endswith(".nc"):
+            raise FileNotFoundError(f"Grid file {grid} not found.")
+        return grid
+
+    if isinstance(grid, str):
+        key = (os.path.abspath(grid), os.path.getmtime(grid))
+        if key not in _grid_ids:
+            with xr.open_dataset(grid) as ds:
+                _grid_ids[key] = grid_id(ds)
+        return _grid_ids[key]
+
+    uuid = grid.attrs.get("uuidOfHGrid")
+    if uuid is None:
+        sha = hashlib.sha1()
+        sha.update(np.ascontiguousarray(grid["clat"].values).tobytes())
+        sha.update(np.ascontiguousarray(grid["clon"].values).tobytes())
+        uuid = sha.hexdigest()
+
+    return uuid
+
+def grid_cache_path(grid, cache_dir=None):
+    """Directory holding the cached arrays of a grid.
+
+    Args:
+        grid (str or xr.Dataset):       icon grid file, opened grid or grid id
+        cache_dir (str, optional):      Defaults to CACHE_DIR.
+
+    Returns:
+        str
+    """
+    path = os.path.join(cache_dir or CACHE_DIR, grid_id(grid))
+    os.makedirs(path, exist_ok=True)
+
+    return path
+
+def write_atomic(fname, write):
+    """Write to a temporary file first, so concurrent readers never see partial files."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fname), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, fname)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+def cached_array(grid, name, compute, cache_dir=None):
+    """Load a grid-derived array from the cache, compute and store it if missing.
+
+    Args:
+        grid (str or xr.Dataset):   icon grid file, opened grid or grid id
+        name (str):                 name of the array in the cache
+        compute (callable):         creates the array, called without arguments
+        cache_dir (str, optional):  Defaults to CACHE_DIR.
+
+    Returns:
+        np.memmap (read-only)
+    """
+    fname = os.path.join(grid_cache_path(grid, cache_dir), f"{name}.npy")
+
+    if not os.path.exists(fname):
+        values = np.asarray(compute())
+        write_atomic(fname, lambda f: np.save(f, values))
+
+    return np.load(fname, mmap_mode="r")
+
+def grid_array(grid, name, degrees=False, cache_dir=None):
+    """Read a variable of the grid file through the cache.
+
+    Args:
+        grid (str or xr.Dataset):   icon grid file, opened grid or grid id
+        name (str):                 variable in grid file, e.g. clat or clon_vertices
+        degrees (bool, optional):   Convert from radian to degrees. Defaults to False.
+        cache_dir (str, optional):  Defaults to CACHE_DIR.
+
+    Returns:
+        np.memmap (read-only)
+    """
+
+    def compute():
+        if isinstance(grid, xr.Dataset):
+            values = grid[name].values
+        else:
+            with xr.open_dataset(grid) as ds:
+                values = ds[name].values
+        if degrees:
+            values = np.rad2deg(values)
+        return values
+
+    return cached_array(grid, f"{name}_deg" if degrees else name, compute, cache_dir)
+
+def grid_index(grid, cache_dir=None):
+    """Spatial index of the cell centers of a grid, built once and cached on disk.
+
+    Args:
+        grid (str or xr.Dataset):   icon grid file, opened grid or grid id
+        cache_dir (str, optional):  Defaults to CACHE_DIR.
+
+    Returns:
+        scipy.spatial.cKDTree
+    """
+    fname = os.path.join(grid_cache_path(grid, cache_dir), "cell_index.pkl")
+
+    if not os.path.exists(fname):
+        tree = build_grid_index(
+            grid_array(grid, "clat", degrees=True, cache_dir=cache_dir),
+            grid_array(grid, "clon", degrees=True, cache_dir=cache_dir),
+        )
+        write_atomic(fname, lambda f: pickle.dump(tree, f, pickle.HIGHEST_PROTOCOL))
+        return tree
+
+    with open(fname, "rb") as f:
+        return pickle.load(f)
+
+def station_lookup(grid, stations=None, k=4, topo=None, cache_dir=None):
+    """Map stations to their nearest cells of a grid.
+
+    All stations are searched in one vectorized query. The table is
+    stored next to the grid cache and only stations that are new or
+    have moved are searched again.
+
+    Args:
+        grid (str or xr.Dataset):       icon grid file, opened grid or grid id
+        stations (list or pd.DataFrame, optional): short names of stations in sdf
+                                        or dataframe like sdf. Defaults to all of sdf.
+        k (int, optional):              Number of nearest cells. Defaults to 4.
+        topo (array, optional):         model topography [m] per cell. Defaults to None.
+        cache_dir (str, optional):      Defaults to CACHE_DIR.
+
+    Returns:
+        pd.DataFrame with stations as columns (like sdf) and rows:
+            lat, lon            station location
+            ind                 index of nearest cell
+            dist                distance to nearest cell [km]
+            neighbours          indices of k nearest cells
+            neighbour_dists     distances to k nearest cells [km]
+            elevation_diff      station elevation - model topography [m]
+                                (nan if no topography is given)
+    """
+    if not isinstance(stations, pd.DataFrame):
+        from stations import sdf
+
+        stations = sdf if stations is None else sdf[list(stations)]
+
+    fname = os.path.join(grid_cache_path(grid, cache_dir), f"stations_{k}nn.pkl")
+    lut = pd.read_pickle(fname) if os.path.exists(fname) else pd.DataFrame()
+
+    # stations which are not in the table yet (or have moved)
+    missing = [
+        st
+        for st in stations.columns
+        if st not in lut.columns
+        or lut[st].lat != stations[st].lat
+        or lut[st].lon != stations[st].lon
+    ]
+
+    if missing:
+        lats = stations.loc["lat", missing].values.astype(np.float64)
+        lons = stations.loc["lon", missing].values.astype(np.float64)
+        inds, dists = inds_from_latlon(
+            grid_index(grid, cache_dir), lats, lons, k=k, return_dist=True
+        )
+        inds = np.reshape(inds, (len(missing), k))
+        dists = np.reshape(dists, (len(missing), k))
+
+        new = pd.DataFrame(
+            {
+                st: pd.Series(
+                    {
+                        "lat": lats[i],
+                        "lon": lons[i],
+                        "ind": int(inds[i, 0]),
+                        "dist": dists[i, 0],
+                        "neighbours": inds[i],
+                        "neighbour_dists": dists[i],
+                    },
+                    dtype=object,
+                )
+                for i, st in enumerate(missing)
+            }
+        )
+        lut = pd.concat([lut.drop(columns=missing, errors="ignore"), new], axis=1)
+        write_atomic(fname, lambda f: lut.to_pickle(f))
+
+    lut = lut[list(stations.columns)].copy()
+
+    if topo is None:
+        lut.loc["elevation_diff"] = np.nan
+    else:
+        topo = np.asarray(topo)
+        lut.loc["elevation_diff"] = (
+            stations.loc["elevation"].values.astype(np.float64)
+            - topo[lut.loc["ind"].values.astype(int)]
+        )
+
+    return lut
+
+def locate_cells(grid, lat, lon, max_steps=50, cache_dir=None):
+    """Find the triangles containing given locations.
+
+    Starting from the nearest cell center, each location walks
+    through the neighbouring cells towards the edge it lies
+    beyond, until the containing triangle is found.
+
+    Args:
+        grid (str or xr.Dataset):   icon grid file, opened grid or grid id
+        lat (float or array):       Latitude(s) of location(s) in degrees
+        lon (float or array):       Longitude(s) of location(s) in degrees
+        max_steps (int, optional):  Maximum number of steps per location. Defaults to 50.
+        cache_dir (str, optional):  Defaults to CACHE_DIR.
+
+    Returns:
+        np.array    Indices of containing cells (-1 if not found, e.g. outside the domain)
+        np.array    Barycentric coordinates w.r.t. the cell vertices, shape (n, 3)
+    """
+    lat = np.atleast_1d(np.asarray(lat, dtype=np.float64)).ravel()
+    lon = np.atleast_1d(np.asarray(lon, dtype=np.float64)).ravel()
+
+    vlat = grid_array(grid, "clat_vertices", degrees=True, cache_dir=cache_dir)
+    vlon = grid_array(grid, "clon_vertices", degrees=True, cache_dir=cache_dir)
+    # connectivity in grid files is 1-based, missing neighbours are <= 0
+    neighbours = grid_array(grid, "neighbor_cell_index", cache_dir=cache_dir) - 1
+    vertices = grid_array(grid, "vertex_of_cell", cache_dir=cache_dir) - 1
+
+    points = latlon_to_xyz(lat, lon)
+    cells = np.asarray(inds_from_latlon(grid_index(grid, cache_dir), lat, lon))
+    found = np.full(len(lat), -1)
+    bary = np.full((len(lat), 3), np.nan)
+
+    active = np.arange(len(lat))
+    for _ in range(max_steps):
+        current = cells[active]
+
+        # solve p = sum(l_i * v_i) for the triangle vertices v_i
+        corners = latlon_to_xyz(vlat[current], vlon[current])
+        lam = np.linalg.solve(
+            np.swapaxes(corners, 1, 2), points[active][..., None]
+        )[..., 0]
+        lam /= lam.sum(axis=1, keepdims=True)
+
+        inside = (lam >= -1e-9).all(axis=1)
+        found[active[inside]] = current[inside]
+        bary[active[inside]] = lam[inside]
+
+        # cross the edge opposite to the vertex with the most negative weight,
+        # i.e. go to the only neighbour which does not share this vertex
+        active = active[~inside]
+        current = current[~inside]
+        corner = np.argmin(lam[~inside], axis=1)
+        opposite = vertices[corner, current]
+        nbs = neighbours[:, current].T
+        shares = (vertices[:, np.maximum(nbs, 0)] == opposite[None, :, None]).any(
+            axis=0
+        ) | (nbs < 0)
+        step = np.argmin(shares, axis=1)
+        can_step = ~shares[np.arange(len(active)), step]
+
+        active = active[can_step]
+        cells[active] = nbs[can_step, step[can_step]]
+        if not len(active):
+            break
+
+    return found, bary
+
+def interpolation_weights(grid, lat, lon, max_steps=50, cache_dir=None):
+    """Barycentric interpolation weights from cell centers to locations.
+
+    Cell values are averaged to the vertices of the containing
+    triangle (mean of all cells sharing the vertex), which are
+    then combined with the barycentric coordinates of the location.
+
+    Args:
+        grid (str or xr.Dataset):   icon grid file, opened grid or grid id
+        lat (float or array):       Latitude(s) of location(s) in degrees
+        lon (float or array):       Longitude(s) of location(s) in degrees
+        max_steps (int, optional):  Maximum number of walk steps. Defaults to 50.
+        cache_dir (str, optional):  Defaults to CACHE_DIR.
+
+    Returns:
+        scipy.sparse.csr_matrix of shape (locations, cells),
+        rows of locations outside the grid are empty
+    """
+    cells, bary = locate_cells(grid, lat, lon, max_steps, cache_dir)
+    vertices = grid_array(grid, "vertex_of_cell", cache_dir=cache_dir) - 1
+    cells_of_vertex = grid_array(grid, "cells_of_vertex", cache_dir=cache_dir) - 1
+    ncells = vertices.shape[1]
+
+    ok = np.where(cells >= 0)[0]
+    # cells around each vertex of the containing triangles: (points, 3, max cells)
+    around = np.moveaxis(cells_of_vertex[:, vertices[:, cells[ok]].T], 0, -1)
+    valid = around >= 0
+    weights = bary[ok][..., None] * valid / valid.sum(axis=-1, keepdims=True)
+
+    rows = np.broadcast_to(ok[:, None, None], around.shape)
+
+    return sparse.csr_matrix(
+        (weights[valid], (rows[valid], around[valid])), shape=(len(cells), ncells)
+    )
+
+def apply_weights(weights, da, cell_dim="cell", out_dims=("point",), out_shape=None):
+    """Apply sparse weights to the cell dimension of a data array.
+
+    All other dimensions are handled in one sparse matrix product.
+    Dask-backed arrays are processed lazily chunk by chunk.
+
+    Args:
+        weights (scipy.sparse matrix):  of shape (outputs, cells)
+        da (xr.DataArray):              data on the native grid
+        cell_dim (str, optional):       Defaults to "cell".
+        out_dims (tuple, optional):     dimensions replacing cell_dim. Defaults to ("point",).
+        out_shape (tuple, optional):    shape of out_dims. Defaults to (outputs,).
+
+    Returns:
+        xr.DataArray    (nan for outputs without weights)
+    """
+    weights = sparse.csr_matrix(weights)
+    out_shape = tuple(out_shape or (weights.shape[0],))
+    empty = np.diff(weights.indptr) == 0
+    dtype = np.result_type(da.dtype, np.float32)
+
+    def _apply(values):
+        lead = values.shape[:-1]
+        flat = values.reshape(-1, values.shape[-1]).astype(dtype, copy=False)
+        out = np.asarray((weights.astype(dtype) @ flat.T).T)
+        out[:, empty] = np.nan
+        return out.reshape(lead + out_shape)
+
+    return xr.apply_ufunc(
+        _apply,
+        da,
+        input_core_dims=[[cell_dim]],
+        output_core_dims=[list(out_dims)],
+        dask="parallelized",
+        output_dtypes=[dtype],
+        dask_gufunc_kwargs={
+            "output_sizes": dict(zip(out_dims, out_shape)),
+            "allow_rechunk": True,
+        },
+    )
+
+# name prefixes of dimensions by role, used if there are no CF attributes
+DIM_NAME_PATTERNS = {
+    "time": ("time",),
+    "index": ("ncells", "cells", "cell"),
+    "level": ("height", "level", "lev", "z_", "alt", "depth"),
+}
+
+# standard names of vertical coordinates
+LEVEL_STANDARD_NAMES = (
+    "height",
+    "altitude",
+    "model_level_number",
+    "air_pressure",
+    "depth",
+)
+
+# dimension roles by dataset: id -> (weak reference, dims, roles)
+_dim_roles = {}
+
+def _dim_role(ds, dim):
+    """Role of one dimension from CF attributes or name."""
+    if dim in ds.coords:
+        coord = ds.coords[dim]
+        axis = coord.attrs.get("axis", "").upper()
+        standard_name = coord.attrs.get("standard_name", "")
+
+        if axis == "T" or standard_name == "time" or coord.dtype.kind == "M":
+            return "time"
+        if (
+            axis == "Z"
+            or "positive" in coord.attrs
+            or standard_name.startswith(LEVEL_STANDARD_NAMES)
+        ):
+            return "level"
+
+    for role, patterns in DIM_NAME_PATTERNS.items():
+        if str(dim).startswith(patterns):
+            return role
+
+    return None
+
+def dim_roles(ds):
+    """Classify all dimensions of a dataset as time, index or level.
+
+    CF attributes of the dimension coordinates (axis, standard_name,
+    positive) are used first, name patterns as fallback. The result is
+    memoized per dataset (as long as its dimensions do not change).
+
+    Args:
+        ds (xr.Dataset or xr.DataArray): icon output
+
+    Returns:
+        dict: dimension -> "time", "index", "level" or None
+
+    """
+    dims = tuple(ds.dims)
+    cached = _dim_roles.get(id(ds))
+    if cached is not None and cached[0]() is ds and cached[1] == dims:
+        return cached[2]
+
+    roles = {dim: _dim_role(ds, dim) for dim in dims}
+
+    key = id(ds)
+    _dim_roles[key] = (weakref.ref(ds, lambda _: _dim_roles.pop(key, None)), dims, roles)
+
+    return roles
+
+def get_dim_names(ds_var, verbose=False, var=None):
     """Retrieve dimension names for specific variable in xarray dataframe.
 
-    Names for time/level/index - dimensions are listed in
-    possible_xxx_names. For a given dataset containing only
-    1 variable the function deduces the dimension names.
+    The dimensions are classified by dim_roles. To select the dimensions
+    of many variables, pass the whole dataset and the variable name, so
+    the dataset is only classified once.
 
     Args:
-        ds_var (xarray df): dataframe for 1 variable
+        ds_var (xarray df): dataframe for 1 variable (or whole dataset)
         verbose (bool): print details
+        var (str, optional): variable in ds_var. Defaults to None (all dims of ds_var).
 
     Returns:
         dim_time (str)
@@ -46,58 +562,153 @@ def get_dim_names(ds_var, verbose):
         dim_level (str)
 
     """
-    possible_time_names = [
-        "time",
-    ]
-    possible_index_names = ["ncells", "cells_1", "cells"]
-    possible_level_names = [
-        "height",
-        "height_1",
-        "height_2",
-        "height_3",
-        "height_4",
-        "level",
-        "level_1",
-        "z_1",
-        "z_2",
-        "z_3",
-    ]
+    roles = dim_roles(ds_var)
+    dims = ds_var[var].dims if var is not None else ds_var.dims
+
+    found = {"time": None, "index": None, "level": None}
+    for dim in dims:
+        role = roles[dim]
+        if role is not None and found[role] is None:
+            found[role] = dim
+
+            if verbose:
+                print(f"Found dim_{role}: {dim}.")
+
+    return found["time"], found["index"], found["level"]
+
+# Swiss Plateau: polygon of (lat, lon) vertices
+MITTELLAND = [
+    (46.79, 6.56),
+    (47.16, 7.29),
+    (47.76, 9.08),
+    (47.44, 9.28),
+    (47.04, 8.00),
+    (46.71, 6.76),
+]
+
+def _nesting_depth(obj):
+    depth = 0
+    while isinstance(obj, (list, tuple, np.ndarray)):
+        obj = obj[0]
+        depth += 1
+    return depth
+
+def _as_multipolygon(region):
+    """Bring a ring, polygon (with holes) or multipolygon to multipolygon form."""
+    depth = _nesting_depth(region)
+    if depth == 2:
+        return [[region]]
+    elif depth == 3:
+        return [region]
+    elif depth == 4:
+        return region
+    raise ValueError("Region has to be a ring, polygon or multipolygon of (lat, lon).")
+
+def polygon_mask(lats, lons, region):
+    """Mask grid points within a region.
+
+    Only points within the bounding box of a polygon are tested.
+
+    Args:
+        lats (np.array):    latitudes of grid points
+        lons (np.array):    longitudes of grid points
+        region (list):      (lat, lon) vertices of a ring, a polygon given as
+                            [outer ring, hole, ...] or a multipolygon given as
+                            list of polygons
+
+    Returns:
+        np.array filled with booleans: grid points within region = True
+    """
+    lats = np.asarray(lats)
+    shape = lats.shape
+    lats = lats.ravel()
+    lons = np.asarray(lons).ravel()
+    mask = np.zeros(lats.size, dtype=bool)
+
+    # matplotlib is only needed here, keep it out of the import of toolbox
+    import matplotlib.path as mpath
+
+    for polygon in _as_multipolygon(region):
+        outer = np.asarray(polygon[0], dtype=np.float64)
+        (lat_min, lon_min), (lat_max, lon_max) = outer.min(axis=0), outer.max(axis=0)
+        candidates = np.nonzero(
+            (lats >= lat_min) & (lats <= lat_max) & (lons >= lon_min) & (lons <= lon_max)
+        )[0]
+        points = np.column_stack([lats[candidates], lons[candidates]])
+
+        inside = mpath.Path(outer).contains_points(points)
+        for hole in polygon[1:]:
+            inside &= ~mpath.Path(np.asarray(hole)).contains_points(points)
+
+        mask[candidates[inside]] = True
 
-    dim_time = None
-    dim_index = None
-    dim_level = None
+    return mask.reshape(shape)
 
-    # loop over dims given in dataset
-    for dim_names in ds_var.dims:
+def geojson_regions(fname, name_property="name"):
+    """Read polygons and multipolygons from a local GeoJSON file.
 
-        # check for time names
-        for time_name in possible_time_names:
-            if time_name in dim_names:
-                dim_time = time_name
+    Args:
+        fname (str):                    GeoJSON file
+        name_property (str, optional):  feature property naming the region. Defaults to "name".
 
-                if verbose:
-                    print(f"Found dim_time: {dim_time}.")
-                break
+    Returns:
+        dict: region name -> multipolygon of (lat, lon) vertices
+    """
+    with open(fname) as f:
+        geojson = json.load(f)
 
-        # check for index names
-        for index_name in possible_index_names:
-            if index_name in dim_names:
-                dim_index = index_name
+    if geojson["type"] == "FeatureCollection":
+        features = geojson["features"]
+    elif geojson["type"] == "Feature":
+        features = [geojson]
+    else:
+        features = [{"geometry": geojson, "properties": {}}]
 
-                if verbose:
-                    print(f"Found dim_index: {dim_index}.")
-                break
+    regions = {}
+    for i, feature in enumerate(features):
+        geometry = feature["geometry"]
+        if geometry["type"] == "Polygon":
+            polygons = [geometry["coordinates"]]
+        elif geometry["type"] == "MultiPolygon":
+            polygons = geometry["coordinates"]
+        else:
+            continue
 
-        # check for level names
-        for level_name in possible_level_names:
-            if level_name in dim_names:
-                dim_level = level_name
+        # GeoJSON positions are (lon, lat)
+        name = (feature.get("properties") or {}).get(name_property, str(i))
+        regions[name] = [
+            [[(lat, lon) for lon, lat, *_ in ring] for ring in polygon]
+            for polygon in polygons
+        ]
 
-                if verbose:
-                    print(f"Found dim_level: {dim_level}.")
-                break
+    return regions
 
-    return dim_time, dim_index, dim_level
+def grid_mask(grid, region, cache_dir=None):
+    """Mask of the cells of a grid within a region, cached per grid and region.
+
+    Args:
+        grid (str or xr.Dataset):   icon grid file, opened grid or grid id
+        region (list):              see polygon_mask
+        cache_dir (str, optional):  Defaults to CACHE_DIR.
+
+    Returns:
+        np.memmap filled with booleans (read-only)
+    """
+    region = _as_multipolygon(region)
+    key = hashlib.sha1(
+        json.dumps(region, default=lambda x: np.asarray(x).tolist()).encode()
+    ).hexdigest()[:16]
+
+    return cached_array(
+        grid,
+        f"mask_{key}",
+        lambda: polygon_mask(
+            grid_array(grid, "clat", degrees=True, cache_dir=cache_dir),
+            grid_array(grid, "clon", degrees=True, cache_dir=cache_dir),
+            region,
+        ),
+        cache_dir,
+    )
 
 def mittelland_mask(lats, lons):
     """Mask for Swiss Plateau.
@@ -109,66 +720,473 @@ def mittelland_mask(lats, lons):
     Returns:
         np.array filled with booleans: grid points within plateau = True
     """
+    return polygon_mask(lats, lons, MITTELLAND)
 
-    # Define the polygon to average in...
-    ll_corner = (46.79, 6.56)
-    p1 = (47.16, 7.29)
-    p2 = (47.76, 9.08)
-    p3 = (47.44, 9.28)
-    p4 = (47.04, 8.00)
-    p5 = (46.71, 6.76)
-
-    # create polygon
-    Path = mpath.Path
-    path_data = [
-        (Path.MOVETO, ll_corner),
-        (Path.LINETO, p1),
-        (Path.LINETO, p2),
-        (Path.LINETO, p3),
-        (Path.LINETO, p4),
-        (Path.LINETO, p5),
-        (Path.CLOSEPOLY, ll_corner),
-    ]
-    codes, verts = zip(*path_data)
-    path = mpath.Path(verts, codes)
+def region_weights(masks, cell_area=None):
+    """Area weights of cells within regions.
 
-    # store original shape
-    shape = lats.shape
+    Args:
+        masks (list of np.array):       boolean cell masks, one per region
+        cell_area (np.array, optional): area of cells. Defaults to equal areas.
+
+    Returns:
+        scipy.sparse.csr_matrix of shape (regions, cells), rows sum up to 1
+    """
+    masks = np.atleast_2d(np.asarray(masks, dtype=bool))
+    area = np.ones(masks.shape[1]) if cell_area is None else np.asarray(cell_area)
+
+    weights = sparse.csr_matrix(masks * area[None, :])
+    totals = np.asarray(weights.sum(axis=1)).ravel()
+    totals[totals == 0] = np.nan
+
+    return sparse.diags(1 / totals) @ weights
+
+def aggregate_regions(
+    da, masks, cell_area=None, stats=("mean",), threshold=None, cell_dim="cell"
+):
+    """Area-weighted statistics of many regions at once.
+
+    Mean and fraction above threshold are computed with one sparse
+    matrix product over all regions and all other dimensions. Missing
+    values are ignored.
+
+    Args:
+        da (xr.DataArray):              data on the native grid
+        masks (dict):                   region name -> boolean cell mask (e.g. from grid_mask)
+        cell_area (np.array, optional): area of cells. Defaults to equal areas.
+        stats (tuple, optional):        any of "mean", "min", "max", "frac_above".
+                                        Defaults to ("mean",).
+        threshold (float, optional):    threshold for "frac_above". Defaults to None.
+        cell_dim (str, optional):       Defaults to "cell".
+
+    Returns:
+        xr.Dataset with one variable per statistic and dimension region
+    """
+    names = list(masks)
+    masks = np.asarray([masks[name] for name in names], dtype=bool)
+    weights = region_weights(masks, cell_area)
+    dtype = np.result_type(da.dtype, np.float32)
+    # weights of valid cells only, used for normalisation
+    valid = apply_weights(weights, da.notnull().astype(dtype), cell_dim, ("region",))
+
+    result = xr.Dataset()
+    for stat in stats:
+        if stat == "mean":
+            result[stat] = (
+                apply_weights(weights, da.fillna(0), cell_dim, ("region",)) / valid
+            )
+
+        elif stat == "frac_above":
+            if threshold is None:
+                raise ValueError("frac_above requires a threshold.")
+            result[stat] = (
+                apply_weights(
+                    weights, (da > threshold).astype(dtype), cell_dim, ("region",)
+                )
+                / valid
+            )
+
+        elif stat in ("min", "max"):
+            reduce = np.nanmin if stat == "min" else np.nanmax
+
+            def _reduce(values, reduce=reduce):
+                out = np.full(values.shape[:-1] + (len(masks),), np.nan)
+                for i, mask in enumerate(masks):
+                    if mask.any():
+                        out[..., i] = reduce(values[..., mask], axis=-1)
+                return out
+
+            result[stat] = xr.apply_ufunc(
+                _reduce,
+                da,
+                input_core_dims=[[cell_dim]],
+                output_core_dims=[["region"]],
+                dask="parallelized",
+                output_dtypes=[np.float64],
+                dask_gufunc_kwargs={
+                    "output_sizes": {"region": len(masks)},
+                    "allow_rechunk": True,
+                },
+            )
+
+        else:
+            raise ValueError(f"Unknown statistic: {stat}.")
+
+    return result.assign_coords(region=names)
+
+def _clip_polygons(poly, n, axis, bound, upper):
+    """Clip convex polygons at an axis-parallel line (Sutherland-Hodgman).
+
+    Args:
+        poly (array):   vertices of shape (polygons, max vertices, 2)
+        n (array):      number of vertices of each polygon
+        axis (int):     0 (x) or 1 (y)
+        bound (array):  position of the line for each polygon
+        upper (bool):   keep the part below (True) or above (False) the line
+
+    Returns:
+        array, array:   clipped polygons (one more vertex) and vertex counts
+    """
+    rows = np.arange(len(poly))
+    out = np.zeros((len(poly), poly.shape[1] + 1, 2))
+    out_n = np.zeros(len(poly), dtype=int)
+
+    def inside(pts):
+        return pts[:, axis] <= bound if upper else pts[:, axis] >= bound
+
+    for j in range(poly.shape[1]):
+        valid = j < n
+        cur = poly[:, j]
+        nxt = poly[rows, np.where(j + 1 < n, j + 1, 0)]
+        cur_in, nxt_in = inside(cur), inside(nxt)
+
+        keep = valid & cur_in
+        out[rows[keep], out_n[keep]] = cur[keep]
+        out_n += keep
+
+        cross = valid & (cur_in != nxt_in)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (bound - cur[:, axis]) / (nxt[:, axis] - cur[:, axis])
+            point = cur + t[:, None] * (nxt - cur)
+        point[:, axis] = bound
+        out[rows[cross], out_n[cross]] = point[cross]
+        out_n += cross
+
+    return out, out_n
+
+def _polygon_areas(poly, n):
+    """Areas of polygons (shoelace formula), see _clip_polygons for the layout."""
+    j = np.arange(poly.shape[1])
+    nxt = np.where(j + 1 < n[:, None], j + 1, 0)
+    nxt_poly = np.take_along_axis(poly, nxt[..., None], axis=1)
+    cross = poly[..., 0] * nxt_poly[..., 1] - nxt_poly[..., 0] * poly[..., 1]
+
+    return 0.5 * np.abs(np.where(j < n[:, None], cross, 0).sum(axis=1))
+
+def _cell_polygons(vlat, vlon, lon_min):
+    """Triangles as polygons in the lat/lon plane, see _clip_polygons for the layout.
+
+    Triangles are unwrapped across the dateline and shifted to start
+    within [lon_min, lon_min + 360). A vertex at a pole becomes an edge
+    along the pole, a triangle enclosing a pole becomes the polar cap
+    between its edges and the pole.
+
+    Args:
+        vlat (array):   vertex latitudes of shape (cells, 3) in degrees
+        vlon (array):   vertex longitudes of shape (cells, 3) in degrees
+        lon_min (float): western edge of the target grid
+
+    Returns:
+        array, array:   polygons of shape (cells, 6, 2) and vertex counts
+    """
+    rows = np.arange(len(vlat))
+    pole = np.abs(vlat) > 90 - 1e-6
+
+    # start with the vertex at the pole (if any)
+    roll = np.where(pole.any(axis=1), np.argmax(pole, axis=1), 0)
+    order = (roll[:, None] + np.arange(3)) % 3
+    vlat = np.take_along_axis(vlat, order, axis=1)
+    vlon = np.take_along_axis(vlon, order, axis=1)
+    has_pole = pole[rows, roll]
+    vlon[has_pole, 0] = vlon[has_pole, 1]
+
+    # walk along the edges with the shortest longitude steps back to
+    #  the first vertex, the vertex at a pole takes the longitude of its neighbours
+    step = (np.diff(vlon, axis=1, append=vlon[:, :1]) + 180) % 360 - 180
+    step[has_pole, 0] = 0
+    step[has_pole, 2] = 0
+    lon = vlon[:, :1] + np.cumsum(np.pad(step, ((0, 0), (1, 0))), axis=1)
+    lat = np.concatenate([vlat, vlat[:, :1]], axis=1)
+    winding = np.where(has_pole, 0, np.round(lon[:, 3] - lon[:, 0]))
+
+    # walk eastwards around enclosed poles
+    west = winding < 0
+    lon[west] = lon[west, ::-1]
+    lat[west] = lat[west, ::-1]
+    pole_lat = np.where(lat[:, :3].mean(axis=1) > 0, 90.0, -90.0)
+
+    poly = np.repeat(np.stack([lon[:, :1], lat[:, :1]], axis=-1), 6, axis=1)
+    poly[:, :3] = np.stack([lon[:, :3], lat[:, :3]], axis=-1)
+    n = np.full(len(vlat), 3)
+
+    # vertex at a pole: edge along the pole
+    poly[has_pole, 0] = np.stack([lon[has_pole, 1], lat[has_pole, 0]], axis=-1)
+    poly[has_pole, 3] = np.stack([lon[has_pole, 2], lat[has_pole, 0]], axis=-1)
+    n[has_pole] = 4
+
+    # enclosed pole: polar cap
+    cap = winding != 0
+    poly[cap, 3] = np.stack([lon[cap, 3], lat[cap, 3]], axis=-1)
+    poly[cap, 4] = np.stack([lon[cap, 3], pole_lat[cap]], axis=-1)
+    poly[cap, 5] = np.stack([lon[cap, 0], pole_lat[cap]], axis=-1)
+    n[cap] = 6
+
+    # shift into the target range
+    shift = np.floor((poly[..., 0].min(axis=1) - lon_min) / 360) * 360
+    poly[..., 0] -= shift[:, None]
+
+    return poly, n
+
+def _box_ranges(edges_lo, edges_hi, vmin, vmax):
+    """Boxes (sorted by position) overlapping the intervals [vmin, vmax]."""
+    order = np.argsort(edges_lo)
+    start = np.searchsorted(edges_hi[order], vmin, side="right")
+    stop = np.searchsorted(edges_lo[order], vmax, side="left")
+
+    return order, start, np.maximum(stop - start, 0)
 
-    # path.contains_points checks whether points are within polygon
-    # however, this function can only handle vectors
-    # -> ravel and unravel
-    latlon = [[lat, lon] for lat, lon in zip(lats.ravel(), lons.ravel())]
-    mask = np.reshape(path.contains_points(latlon), shape)
+def remap_weights(
+    grid, lats, lons, method="nearest", max_dist=None, block=200000, cache_dir=None
+):
+    """Weights to remap from the native grid to a regular lat/lon grid.
 
-    return mask
+    nearest:        every target point takes the value of the nearest cell
+    conservative:   the weight of a cell is the area of its overlap with the
+                    target box (triangles clipped at the box edges in the
+                    lat/lon plane), normalized by the covered area of the box.
+                    Area integrals are preserved up to the lat/lon plane
+                    approximation within a cell.
 
-def deaverage(arr):
+    The weights are stored in the grid cache and reused.
+
+    Args:
+        grid (str or xr.Dataset):       icon grid file, opened grid or grid id
+        lats (1d array):                target latitudes in degrees (box centers)
+        lons (1d array):                target longitudes in degrees (box centers)
+        method (str, optional):         "nearest" or "conservative". Defaults to "nearest".
+        max_dist (float, optional):     nearest: max distance [km] to a cell center.
+                                        Defaults to None.
+        block (int, optional):          conservative: cells clipped at once.
+                                        Defaults to 200000.
+        cache_dir (str, optional):      Defaults to CACHE_DIR.
+
+    Returns:
+        scipy.sparse.csr_matrix of shape (lats * lons, cells)
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    key = hashlib.sha1(
+        json.dumps([method, max_dist, lats.tolist(), lons.tolist()]).encode()
+    ).hexdigest()[:16]
+    fname = os.path.join(grid_cache_path(grid, cache_dir), f"remap_{key}.npz")
+
+    if os.path.exists(fname):
+        return sparse.load_npz(fname)
+
+    ncells = grid_array(grid, "clat", cache_dir=cache_dir).size
+    lat2d, lon2d = np.meshgrid(lats, lons, indexing="ij")
+
+    if method == "nearest":
+        inds, dists = inds_from_latlon(
+            grid_index(grid, cache_dir), lat2d.ravel(), lon2d.ravel(), return_dist=True
+        )
+        ok = np.ones(inds.size, dtype=bool) if max_dist is None else dists <= max_dist
+        weights = sparse.csr_matrix(
+            (np.ones(ok.sum()), (np.where(ok)[0], inds[ok])), shape=(inds.size, ncells)
+        )
+
+    elif method == "conservative":
+        dlat = np.abs(np.diff(lats)).mean() if lats.size > 1 else 1.0
+        dlon = np.abs(np.diff(lons)).mean() if lons.size > 1 else 1.0
+        lat_lo, lat_hi = lats - dlat / 2, lats + dlat / 2
+        lon_lo, lon_hi = lons - dlon / 2, lons + dlon / 2
+
+        vlat = grid_array(grid, "clat_vertices", degrees=True, cache_dir=cache_dir)
+        vlon = grid_array(grid, "clon_vertices", degrees=True, cache_dir=cache_dir)
+
+        rows, cols, areas = [], [], []
+        for first in range(0, ncells, block):
+            cells = np.arange(first, min(first + block, ncells))
+            poly, n = _cell_polygons(
+                np.asarray(vlat[cells], dtype=np.float64),
+                np.asarray(vlon[cells], dtype=np.float64),
+                lon_lo.min(),
+            )
+
+            # cells across the eastern edge of a global target grid
+            seam = poly[..., 0].max(axis=1) > lon_lo.min() + 360
+            copy = poly[seam]
+            copy[..., 0] -= 360
+            poly = np.concatenate([poly, copy])
+            n = np.concatenate([n, n[seam]])
+            cells = np.concatenate([cells, cells[seam]])
+
+            # candidate boxes of each polygon
+            lat_order, lat_start, lat_count = _box_ranges(
+                lat_lo, lat_hi, poly[..., 1].min(axis=1), poly[..., 1].max(axis=1)
+            )
+            lon_order, lon_start, lon_count = _box_ranges(
+                lon_lo, lon_hi, poly[..., 0].min(axis=1), poly[..., 0].max(axis=1)
+            )
+            counts = lat_count * lon_count
+            tri = np.repeat(np.arange(len(cells)), counts)
+            k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            ilat = lat_order[lat_start[tri] + k // lon_count[tri]]
+            ilon = lon_order[lon_start[tri] + k % lon_count[tri]]
+
+            poly, n = poly[tri], n[tri]
+            for axis, bound, upper in [
+                (0, lon_lo[ilon], False),
+                (0, lon_hi[ilon], True),
+                (1, lat_lo[ilat], False),
+                (1, lat_hi[ilat], True),
+            ]:
+                poly, n = _clip_polygons(poly, n, axis, bound, upper)
+
+            area = _polygon_areas(poly, n)
+            ok = area > 0
+            rows.append(ilat[ok] * lons.size + ilon[ok])
+            cols.append(cells[tri[ok]])
+            areas.append(area[ok])
+
+        weights = sparse.csr_matrix(
+            (np.concatenate(areas), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(lat2d.size, ncells),
+        )
+        totals = np.asarray(weights.sum(axis=1)).ravel()
+        totals[totals == 0] = 1
+        weights = sparse.csr_matrix(sparse.diags(1 / totals) @ weights)
+
+    else:
+        raise ValueError(f"Unknown remapping method: {method}.")
+
+    write_atomic(fname, lambda f: sparse.save_npz(f, weights))
+
+    return weights
+
+def remap(da, weights, lats, lons, cell_dim="cell"):
+    """Remap data from the native grid to a regular lat/lon grid.
+
+    Args:
+        da (xr.DataArray):              data on the native grid (may be dask-backed)
+        weights (scipy.sparse matrix):  from remap_weights
+        lats (1d array):                target latitudes
+        lons (1d array):                target longitudes
+        cell_dim (str, optional):       Defaults to "cell".
+
+    Returns:
+        xr.DataArray with dimensions lat and lon instead of cell_dim
+    """
+    return apply_weights(
+        weights, da, cell_dim, ("lat", "lon"), (len(lats), len(lons))
+    ).assign_coords(lat=np.asarray(lats), lon=np.asarray(lons))
+
+def deaverage(arr, dim="time", start=None, offset=0):
     """De-average values in array.
 
     Values of some variables have been averaged
     since beginning of the model simulation.
 
+    The de-averaged value of step i is the mean between steps i-1 and i:
+        (arr[i] * n[i] - arr[i-1] * n[i-1]) / (n[i] - n[i-1])
+    where n is the number of steps (or the time) since simulation start.
+    Arrays of any rank are de-averaged along dim without Python loops,
+    dask arrays and dask-backed xarray objects lazily.
+
     Args:
-        arr (1d array): ICON output variable
+        arr (array, xr.DataArray or xr.Dataset): ICON output variable(s),
+                                    numpy and dask arrays are de-averaged along the first axis
+        dim (str, optional):        time dimension of xarray input. Defaults to "time".
+        start (str or datetime, optional): start of simulation (YYmmddHH or YYYYmmddHH),
+                                    requires a time coordinate along dim. Defaults to None.
+        offset (int, optional):     number of steps between simulation start and
+                                    first value, if start is not given. Defaults to 0.
 
     Returns:
-        1d array: de-averaged output
+        de-averaged output of same type and shape (first value is nan)
 
     """
-    # length of input
-    n = len(arr)
+    if isinstance(arr, xr.Dataset):
+        return arr.map(
+            lambda var: deaverage(var, dim, start, offset) if dim in var.dims else var,
+            keep_attrs=True,
+        )
+
+    if isinstance(arr, xr.DataArray):
+        dtype = np.result_type(arr.dtype, np.float32)
+        if start is None:
+            n = xr.DataArray(np.arange(arr.sizes[dim]) + offset, dims=dim)
+        else:
+            n = (arr[dim] - np.datetime64(validtime_from_leadtime(start, 0))) / (
+                np.timedelta64(1, "h")
+            )
+        n = n.astype(dtype)
+
+        weighted = arr * n
+        de_arr = (weighted - weighted.shift({dim: 1})) / (n - n.shift({dim: 1}))
+
+        return de_arr.rename(arr.name).assign_attrs(arr.attrs)
+
+    n = np.arange(len(arr), dtype=np.float64) + offset
+    n = n.reshape((-1,) + (1,) * (np.ndim(arr) - 1))
+
+    # dask arrays stay lazy (dask is only imported for them)
+    if type(arr).__module__.startswith("dask."):
+        import dask.array as dsa
+
+        weighted = arr.astype(np.float64) * n
+        prev = dsa.concatenate([dsa.full_like(weighted[:1], np.nan), weighted[:-1]])
+        n_prev = np.concatenate([np.full_like(n[:1], np.nan), n[:-1]])
+
+        return (weighted - prev.rechunk(weighted.chunks)) / (n - n_prev)
+
+    arr = np.asarray(arr, dtype=np.float64)
 
     # fill with nan (first value will stay nan)
-    de_arr = np.empty(n)
-    de_arr[:] = np.nan
+    de_arr = np.full(arr.shape, np.nan)
 
     # calculate de-averaged values
-    for i in range(1, len(arr)):
-        de_arr[i] = arr[i] * (i) - arr[i - 1] * (i - 1)
+    de_arr[1:] = (arr[1:] * n[1:] - arr[:-1] * n[:-1]) / (n[1:] - n[:-1])
 
     return de_arr
 
+def deaverage_files(files, var, start=None, accumulated=False, dim="time"):
+    """De-average a variable of a forecast split into many output files.
+
+    The files are read in lead-time order and only the previous
+    step is kept in memory, so memory stays flat for long forecasts.
+
+    Args:
+        files (list of str):        icon output files (one or more steps each)
+        var (str):                  variable in files
+        start (str or datetime, optional): start of simulation (YYmmddHH or YYYYmmddHH).
+                                    Defaults to None: first step is simulation start.
+        accumulated (bool, optional): values are accumulated instead of averaged
+                                    since simulation start. Defaults to False.
+        dim (str, optional):        time dimension. Defaults to "time".
+
+    Yields:
+        xr.DataArray: de-averaged (de-accumulated) step, starting with the second step
+
+    """
+    if start is not None:
+        start = np.datetime64(validtime_from_leadtime(start, 0))
+
+    def first_time(fname):
+        with xr.open_dataset(fname) as ds:
+            return decode_absolute_time(ds[[dim]])[dim].values[0]
+
+    prev = None
+    for fname in sorted(files, key=first_time):
+        with xr.open_dataset(fname) as ds:
+            field = decode_absolute_time(ds[[var]])[var].load()
+
+        for i in range(field.sizes[dim]):
+            cur = field.isel({dim: [i]})
+            if start is None:
+                start = cur[dim].values[0]
+
+            if prev is not None:
+                if accumulated:
+                    values = cur.values - prev.values
+                else:
+                    n = (cur[dim].values[0] - start) / np.timedelta64(1, "h")
+                    n_prev = (prev[dim].values[0] - start) / np.timedelta64(1, "h")
+                    values = (cur.values * n - prev.values * n_prev) / (n - n_prev)
+                yield cur.copy(data=values)
+
+            prev = cur
+
 def validtime_from_leadtime(date, leadtime, verbose=False):
     """Calculate validtime from leadtime.
 
@@ -201,36 +1219,327 @@ def validtime_from_leadtime(date, leadtime, verbose=False):
 
     return validtime
 
-def add_grid_info1(file, grid):
+def transform_variables(ds, var_names, start=None, offset=0, vdf=None):
+    """Apply the attributes of variables.vdf to icon output.
+
+    Each variable is taken from its icon_name field, de-averaged if
+    flagged avg, scaled with mult and shifted by plus. On dask-backed
+    datasets nothing is computed: all steps become one graph, so the
+    transformation costs a single pass over the data.
+
+    Args:
+        ds (xr.Dataset): icon output
+        var_names (list of str): variables in vdf, e.g. ["2m_temp", "sw_down"]
+        start (str or datetime, optional): see deaverage. Defaults to None.
+        offset (int, optional): see deaverage. Defaults to 0.
+        vdf (pd.DataFrame, optional): Defaults to variables.vdf.
+
+    Returns:
+        xr.Dataset: transformed variables named like in vdf
+
+    """
+    if vdf is None:
+        from variables import vdf
+
+    transformed = {}
+    for var in var_names:
+        icon_name = vdf[var].icon_name
+        if icon_name is None:
+            raise KeyError(f"No icon_name defined for {var} in vdf.")
+
+        da = ds[icon_name]
+        if vdf[var].avg:
+            dim_time, _, _ = get_dim_names(ds, var=icon_name)
+            if dim_time is None:
+                raise ValueError(
+                    f"{var} is flagged avg, but {icon_name} has no time dimension to de-average."
+                )
+            da = deaverage(da, dim_time, start, offset)
+
+        transformed[var] = (da * vdf[var].mult + vdf[var].plus).assign_attrs(
+            long_name=vdf[var].long_name, units=vdf[var].unit
+        )
+
+    return xr.Dataset(transformed)
+
+def _interp_columns(values, z, target):
+    """Linear interpolation of columns (last axis) to target heights."""
+    # compute in the dtype declared by interp_to_altitudes
+    target = target.astype(np.result_type(values.dtype, z.dtype, np.float32), copy=False)
+    nlev = values.shape[-1]
+    lead = np.broadcast_shapes(values.shape[:-1], z.shape[:-1], target.shape[:-1])
+    values = np.broadcast_to(values, lead + (nlev,))
+    z = np.broadcast_to(z, lead + (nlev,))
+    target = np.broadcast_to(target, lead + target.shape[-1:])
+
+    # columns with ascending heights
+    order = np.argsort(z, axis=-1)
+    z = np.take_along_axis(z, order, axis=-1)
+    values = np.take_along_axis(values, order, axis=-1)
+
+    # levels below each target height
+    below = (z[..., None, :] <= target[..., :, None]).sum(axis=-1)
+    lower = np.clip(below - 1, 0, nlev - 2)
+    z0 = np.take_along_axis(z, lower, axis=-1)
+    z1 = np.take_along_axis(z, lower + 1, axis=-1)
+    v0 = np.take_along_axis(values, lower, axis=-1)
+    v1 = np.take_along_axis(values, lower + 1, axis=-1)
+
+    out = v0 + (target - z0) / (z1 - z0) * (v1 - v0)
+    out[(target < z[..., :1]) | (target > z[..., -1:])] = np.nan
+
+    return out
+
+def interp_to_altitudes(da, heights, altitudes, level_dim=None, alt_dim="altitude"):
+    """Interpolate model columns linearly to target altitudes.
+
+    All columns (e.g. times and stations) are interpolated at once,
+    dask-backed data lazily chunk by chunk.
+
+    Args:
+        da (xr.DataArray): model data, e.g. (time, level, cell) or (time, level, station)
+        heights (xr.DataArray): height of the model levels (e.g. z_mc), same
+            level dimension as da and broadcastable against it
+        altitudes (array or xr.DataArray): target altitudes, 1d for all columns or
+            with dimension alt_dim and any dimensions of da (e.g. station, time)
+            for individual profiles (pad with nan)
+        level_dim (str, optional): Defaults to the level dimension of da.
+        alt_dim (str, optional): dimension of the target altitudes. Defaults to "altitude".
+
+    Returns:
+        xr.DataArray with alt_dim instead of level_dim (nan outside model columns)
+
+    """
+    if level_dim is None:
+        _, _, level_dim = get_dim_names(da)
+
+    if not isinstance(altitudes, xr.DataArray):
+        altitudes = np.asarray(altitudes, dtype=np.float64)
+        altitudes = xr.DataArray(altitudes, dims=alt_dim, coords={alt_dim: altitudes})
+
+    return xr.apply_ufunc(
+        _interp_columns,
+        da,
+        heights,
+        altitudes,
+        input_core_dims=[[level_dim], [level_dim], [alt_dim]],
+        output_core_dims=[[alt_dim]],
+        dask="parallelized",
+        output_dtypes=[np.result_type(da.dtype, heights.dtype, np.float32)],
+        dask_gufunc_kwargs={"allow_rechunk": True},
+    )
+
+# string formats of simulation starts, by length
+DATE_FORMATS = {8: "%y%m%d%H", 10: "%Y%m%d%H"}
+
+def validtimes_from_leadtimes(dates, leadtimes):
+    """Calculate validtimes for arrays of simulation starts and leadtimes.
+
+    The format of string dates is detected once for the whole batch.
+
+    Args:
+        dates (array-like):     starts of simulation: datetime64, pd.Index or
+                                strings (YYmmddHH or YYYYmmddHH)
+        leadtimes (array-like): leadtimes in hours, broadcast against dates
+
+    Returns:
+        np.array of datetime64[ns]
+
+    """
+    dates = np.asarray(dates)
+
+    if dates.size == 0:
+        ini = np.empty(dates.shape, dtype="datetime64[ns]")
+    elif dates.dtype.kind in "OUS" and isinstance(dates.flat[0], (str, bytes)):
+        dates = dates.astype(str)
+        lengths = np.unique(np.char.str_len(dates))
+        if len(lengths) != 1 or lengths[0] not in DATE_FORMATS:
+            raise ValueError(
+                f"Dates do not match any known format: {', '.join(DATE_FORMATS.values())}."
+            )
+        ini = pd.to_datetime(dates.ravel(), format=DATE_FORMATS[lengths[0]])
+        ini = ini.values.reshape(dates.shape)
+    else:
+        ini = pd.to_datetime(dates.ravel()).values.reshape(dates.shape)
+
+    leadtimes = np.round(np.asarray(leadtimes, dtype=np.float64) * 3600)
+
+    return (ini + leadtimes.astype("timedelta64[s]")).astype("datetime64[ns]")
+
+def decode_absolute_time(ds):
+    """Decode time axes in icon's absolute format (units "day as %Y%m%d.%f").
+
+    xarray leaves these axes as floats, e.g. 20211119.5 for 2021-11-19 12:00.
+
+    Args:
+        ds (xr.dataset): icon output
+
+    Returns:
+        xr.dataset: with these axes as datetime64[ns]
+
+    """
+    decoded = {}
+    for name, var in ds.variables.items():
+        if not str(var.attrs.get("units", "")).startswith("day as"):
+            continue
+        values = np.asarray(var.values, dtype=np.float64)
+        days = np.floor(values)
+        times = pd.to_datetime(
+            days.ravel().astype(np.int64).astype(str), format="%Y%m%d"
+        ) + pd.to_timedelta(np.round((values - days).ravel() * 86400), unit="s")
+        attrs = {
+            key: val for key, val in var.attrs.items() if key not in ("units", "calendar")
+        }
+        decoded[name] = xr.Variable(
+            var.dims, times.values.reshape(values.shape), attrs, var.encoding
+        )
+
+    ds = ds.assign_coords({name: var for name, var in decoded.items() if name in ds.coords})
+
+    return ds.assign({name: var for name, var in decoded.items() if name not in ds.coords})
+
+# grid variables read through the grid cache by load_grid (if present in grid file)
+GRID_VARIABLES = [
+    "clon",
+    "clat",
+    "clon_vertices",
+    "clat_vertices",
+    "cell_area",
+    "neighbor_cell_index",
+    "vertex_of_cell",
+    "cells_of_vertex",
+]
+
+# memory limit for grids kept by load_grid, can be set with $ICON_UTILS_GRID_CACHE_MB
+GRID_CACHE_MAX_BYTES = int(os.environ.get("ICON_UTILS_GRID_CACHE_MB", 2048)) * 2**20
+
+# grids opened in this process, least recently used first
+_grid_registry = OrderedDict()
+
+def load_grid(grid):
+    """Open an icon grid file once per process.
+
+    Coordinates, vertices, areas and neighbours (GRID_VARIABLES) are
+    memory-mapped from the grid cache (see grid_array), so only the
+    first process on a grid reads them from the netcdf file. All other
+    variables stay lazy. Grids are kept in a least recently used cache
+    limited to GRID_CACHE_MAX_BYTES.
+
+    Args:
+        grid (str): icon grid file in netcdf
+
+    Returns:
+        dict: ds (xr.Dataset of grid file, GRID_VARIABLES read-only) and
+              coords (float32 clon, clat, clon_bnds, clat_bnds, read-only)
+
+    """
+    key = (os.path.abspath(grid), os.path.getmtime(grid))
+
+    if key in _grid_registry:
+        _grid_registry.move_to_end(key)
+        return _grid_registry[key]
+
+    ds_grid = xr.open_dataset(grid)
+    cached = {
+        name: ds_grid[name].variable.copy(data=grid_array(grid, name))
+        for name in GRID_VARIABLES
+        if name in ds_grid.variables
+    }
+    ds_grid = ds_grid.assign_coords(
+        {name: var for name, var in cached.items() if name in ds_grid.coords}
+    ).assign({name: var for name, var in cached.items() if name not in ds_grid.coords})
+
+    def float32(name):
+        return cached_array(grid, f"{name}_f32", lambda: np.float32(grid_array(grid, name)))
+
+    coords = {
+        "clon": float32("clon"),
+        "clat": float32("clat"),
+        "clon_bnds": float32("clon_vertices"),
+        "clat_bnds": float32("clat_vertices"),
+    }
+
+    nbytes = sum(values.nbytes for values in coords.values()) + sum(
+        var.nbytes for var in cached.values()
+    )
+    _grid_registry[key] = {"ds": ds_grid, "coords": coords, "nbytes": nbytes}
+
+    # evict least recently used grids, but keep the new one
+    while (
+        len(_grid_registry) > 1
+        and sum(entry["nbytes"] for entry in _grid_registry.values())
+        > GRID_CACHE_MAX_BYTES
+    ):
+        _, entry = _grid_registry.popitem(last=False)
+        entry["ds"].close()
+
+    return _grid_registry[key]
+
+def grid_coords(grid):
+    """Cell centers and vertices of a grid as float32, read once per process.
+
+    The arrays are memory-mapped from the grid cache, shared between
+    all callers and read-only.
+
+    Args:
+        grid (str): icon grid file in netcdf
+
+    Returns:
+        dict: clon, clat, clon_bnds, clat_bnds (radian)
+
+    """
+    return load_grid(grid)["coords"]
+
+def add_grid_info1(file, grid, variables=None, chunks=None):
     """Add grid information to icon dataset.
 
+    Nothing but the grid coordinates is read before data is accessed.
+    The grid coordinates are taken from the grid cache and shared.
+
     Args:
         file (str): icon output file in netcdf
         grid (str): icon grid file in netcdf
+        variables (list, optional): variables to keep. Defaults to None (all).
+        chunks (dict, optional): open lazily with dask chunks, e.g. {} for
+            the chunks on disk. Defaults to None (no dask).
 
     Returns:
         xr.dataset: merged dataset
 
     """
-    ds = xr.open_dataset(file).squeeze()
-    ds_grid = xr.open_dataset(grid)
+    ds = decode_absolute_time(xr.open_dataset(file, chunks=chunks))
+    if variables is not None:
+        ds = ds[list(variables)]
+    ds = ds.squeeze()
 
     # check how index is called in specified files
     grid_ind_name = 'cell'
     icon_ind_name = 'cells'
 
     # combine
-    merged = ds.rename_dims({icon_ind_name:grid_ind_name}
-                        ).assign_coords(
-                        clon=('cell', np.float32(ds_grid.coords['clon'].values))
+    return attach_grid(ds.rename_dims({icon_ind_name: grid_ind_name}), grid)
+
+def attach_grid(ds, grid):
+    """Attach grid coordinates to icon dataset with cell dimension "cell".
+
+    Args:
+        ds (xr.dataset): icon output
+        grid (str): icon grid file in netcdf
+
+    Returns:
+        xr.dataset: merged dataset
+
+    """
+    coords = grid_coords(grid)
+
+    merged = ds.assign_coords(
+                        clon=('cell', coords['clon'])
                         ).assign_coords(
-                        clat=('cell', np.float32(ds_grid.coords['clat'].values))
+                        clat=('cell', coords['clat'])
                         ).assign_coords(
-                        #clat_bnds=(('cell','vertices'), np.float32(ds_grid.coords['clat_vertices'].values))
-                        clat_bnds=(('cell','vertices'), np.float32(ds_grid['clat_vertices'].values))
+                        clat_bnds=(('cell','vertices'), coords['clat_bnds'])
                         ).assign_coords(
-                        #clon_bnds=(('cell','vertices'), np.float32(ds_grid.coords['clon_vertices'].values))
-                        clon_bnds=(('cell','vertices'), np.float32(ds_grid['clon_vertices'].values))
+                        clon_bnds=(('cell','vertices'), coords['clon_bnds'])
                         )
     
     merged.clon.attrs['standard_name']='longitude'
@@ -244,6 +1553,306 @@ def add_grid_info1(file, grid):
 
     return merged
 
+def open_run(files, grid, variables=None, chunks=None, parallel=True, verbose=False):
+    """Open all output files of a run as one dataset with grid information.
+
+    The files are opened in parallel and concatenated along time
+    (ordered by their time coordinate). The cell dimension is renamed
+    to "cell" and the grid coordinates are attached once.
+
+    Args:
+        files (str or list): glob pattern or list of icon output files
+        grid (str): icon grid file in netcdf
+        variables (list, optional): variables to keep. Defaults to None (all).
+        chunks (dict, optional): dask chunks. Defaults to None (chunks on disk).
+        parallel (bool, optional): open files in parallel with dask. Defaults to True.
+        verbose (bool, optional): print details. Defaults to False.
+
+    Returns:
+        xr.dataset: dask-backed dataset of the whole run
+
+    """
+    if isinstance(files, str):
+        files = sorted(glob.glob(files))
+
+    def preprocess(ds):
+        ds = decode_absolute_time(ds)
+        return ds if variables is None else ds[list(variables)]
+
+    ds = xr.open_mfdataset(
+        files,
+        combine="by_coords",
+        data_vars="minimal",
+        coords="minimal",
+        compat="override",
+        chunks=chunks or {},
+        parallel=parallel,
+        preprocess=preprocess,
+    )
+
+    dim_time, dim_index, dim_level = get_dim_names(ds, verbose)
+    names = {dim_time: "time", dim_index: "cell"}
+    ds = ds.rename_dims({old: new for old, new in names.items() if old not in (None, new)})
+
+    if verbose:
+        print(f"Opened {len(files)} files with {ds.sizes.get('time', 1)} time steps.")
+
+    return attach_grid(ds, grid)
+
+def coalesce_indices(inds, max_gap=0):
+    """Group indices into as few contiguous ranges as possible.
+
+    Args:
+        inds (array): indices (any order, duplicates allowed)
+        max_gap (int, optional): read up to max_gap unneeded indices to
+            join two ranges. Defaults to 0.
+
+    Returns:
+        list of (start, stop) tuples
+
+    """
+    inds = np.unique(inds)
+    if len(inds) == 0:
+        return []
+
+    breaks = np.nonzero(np.diff(inds) > max_gap + 1)[0] + 1
+    starts = inds[np.r_[0, breaks]]
+    stops = inds[np.r_[breaks - 1, len(inds) - 1]] + 1
+
+    return list(zip(starts.tolist(), stops.tolist()))
+
+def read_cells(file, inds, variables=None, levels=None, max_gap=0):
+    """Read only the given cells (and levels) from an icon output file.
+
+    The cell indices are sorted and coalesced into contiguous ranges,
+    so only these hyperslabs are read from the netcdf/hdf5 file.
+
+    Args:
+        file (str): icon output file in netcdf
+        inds (array or pd.DataFrame): cell indices or a station lookup table
+            (see station_lookup)
+        variables (list, optional): variables to read. Defaults to None
+            (all variables with a cell dimension).
+        levels (dict, optional): indices to read along other dimensions,
+            e.g. {"height": np.arange(60, 80)}, returned in ascending order.
+            Defaults to None (all).
+        max_gap (int, optional): see coalesce_indices. Defaults to 0.
+
+    Returns:
+        xr.dataset: with dimension "station" (lookup table) or "point"
+            instead of the cell dimension
+
+    """
+    import netCDF4
+
+    if isinstance(inds, pd.DataFrame):
+        point_dim = "station"
+        point_coords = {"station": inds.columns.values}
+        inds = inds.loc["ind"].values.astype(int)
+    else:
+        point_dim = "point"
+        point_coords = {}
+        inds = np.atleast_1d(np.asarray(inds, dtype=int))
+
+    # empty selections are read as an empty range
+    ranges = coalesce_indices(inds, max_gap) or [(0, 0)]
+    read_inds = np.concatenate([np.arange(start, stop) for start, stop in ranges])
+    positions = np.searchsorted(read_inds, inds)
+    levels = {dim: np.sort(np.atleast_1d(ind)) for dim, ind in (levels or {}).items()}
+
+    data_vars = {}
+    coords = {}
+    with netCDF4.Dataset(file) as nc:
+        # decoding (scale, offset, missing values) is left to xarray
+        nc.set_auto_maskandscale(False)
+
+        if variables is None:
+            variables = [
+                name
+                for name, var in nc.variables.items()
+                if any("cell" in dim for dim in var.dimensions)
+            ]
+
+        for name in variables:
+            var = nc.variables[name]
+            cell_axis = [i for i, dim in enumerate(var.dimensions) if "cell" in dim][0]
+            selection = [levels.get(dim, slice(None)) for dim in var.dimensions]
+
+            slabs = []
+            for start, stop in ranges:
+                selection[cell_axis] = slice(start, stop)
+                slabs.append(var[tuple(selection)])
+            values = np.take(np.concatenate(slabs, axis=cell_axis), positions, cell_axis)
+
+            dims = list(var.dimensions)
+            dims[cell_axis] = point_dim
+            data_vars[name] = xr.Variable(dims, values, var.__dict__)
+
+            # coordinates of other dimensions, e.g. time or height
+            for dim in var.dimensions:
+                if dim in nc.variables and dim not in coords and "cell" not in dim:
+                    coord = nc.variables[dim]
+                    coords[dim] = xr.Variable(
+                        (dim,), coord[levels.get(dim, slice(None))], coord.__dict__
+                    )
+
+    ds = xr.Dataset(data_vars, coords={**coords, **point_coords})
+    ds = ds.assign_coords({point_dim + "_cell": (point_dim, inds)})
+
+    return decode_absolute_time(xr.decode_cf(ds))
+
+def columns_schema():
+    """Schema of the station columns written by extract_station_columns."""
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ("time", pa.timestamp("ns")),
+            ("station", pa.dictionary(pa.int32(), pa.string())),
+            ("variable", pa.dictionary(pa.int32(), pa.string())),
+            ("level", pa.float64()),
+            ("value", pa.float32()),
+        ]
+    )
+
+def _extract_run(fname, files, lut, variables, levels):
+    """Extract station columns of one run and write them to fname."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    ds = xr.concat(
+        [read_cells(file, lut, variables, levels) for file in sorted(files)], dim="time"
+    )
+
+    frames = []
+    for name in variables:
+        df = ds[name].drop_vars("station_cell").to_dataframe(name="value").reset_index()
+        level_dims = [dim for dim in ds[name].dims if dim not in ("time", "station")]
+        df = df.rename(columns=dict.fromkeys(level_dims, "level"))
+        df["variable"] = name
+        frames.append(df)
+
+    df = pd.concat(frames, ignore_index=True)
+    if "level" not in df.columns:
+        df["level"] = np.nan
+
+    # same schema in every run, so the store can be read as one dataset
+    schema = columns_schema()
+    table = pa.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False)
+
+    write_atomic(fname, lambda f: pq.write_table(table, f))
+
+    return fname
+
+def extract_station_columns(
+    runs, grid, variables, out_dir, stations=None, levels=None, processes=4, verbose=False
+):
+    """Extract model columns at stations for many runs into a parquet store.
+
+    The runs are distributed over a pool of processes. Each run is
+    written to <out_dir>/run=<run>/columns.parquet with the columns
+    time, station, variable, level and value (see columns_schema). Runs which have already
+    been written are skipped, so an interrupted extraction can be resumed.
+
+    Args:
+        runs (dict): run (e.g. "21111900") -> list or glob pattern of icon output files
+        grid (str): icon grid file in netcdf
+        variables (list): variables to extract, e.g. ["T", "QV", "QC", "clc"]
+        out_dir (str): directory of the parquet store
+        stations (list or pd.DataFrame, optional): see station_lookup. Defaults to all of sdf.
+        levels (dict, optional): see read_cells. Defaults to None (all levels).
+        processes (int, optional): number of processes. Defaults to 4.
+        verbose (bool, optional): print details. Defaults to False.
+
+    Returns:
+        list of str: parquet files of all runs
+
+    """
+    lut = station_lookup(grid, stations)
+
+    fnames = {}
+    todo = {}
+    for run, files in runs.items():
+        fnames[run] = os.path.join(out_dir, f"run={run}", "columns.parquet")
+        if os.path.exists(fnames[run]):
+            if verbose:
+                print(f"Skipping run {run}: already extracted.")
+            continue
+        os.makedirs(os.path.dirname(fnames[run]), exist_ok=True)
+        todo[run] = sorted(glob.glob(files)) if isinstance(files, str) else files
+
+    with ProcessPoolExecutor(processes) as pool:
+        futures = {
+            pool.submit(_extract_run, fnames[run], files, lut, variables, levels): run
+            for run, files in todo.items()
+        }
+        for future in as_completed(futures):
+            future.result()
+            if verbose:
+                print(f"Extracted run {futures[future]}.")
+
+    return list(fnames.values())
+
+def convert_to_zarr(
+    runs, grid, store, variables=None, chunk_bytes=16 * 2**20, cell_chunk=None, verbose=False
+):
+    """Convert icon output to a zarr store chunked for station time series.
+
+    Each chunk holds all time steps and levels of a range of cells, so
+    the time series at one station is a single chunk read. The number of
+    cells per chunk is chosen per variable, so a chunk takes about
+    chunk_bytes (fewer cells for 3d fields than for 2d fields). An archive of
+    runs is written with one group per run and the metadata of the whole
+    store is consolidated at the end.
+
+    Args:
+        runs (str, list or dict): glob pattern or list of icon output files of
+            one run, or dict: run (e.g. "21111900") -> glob pattern or list of files
+        grid (str): icon grid file in netcdf
+        store (str): path of zarr store
+        variables (list, optional): variables to convert. Defaults to None (all).
+        chunk_bytes (int, optional): target size of a chunk. Defaults to 16 MiB.
+        cell_chunk (int, optional): cells per chunk for all variables instead
+            of chunk_bytes. Defaults to None.
+        verbose (bool, optional): print details. Defaults to False.
+
+    Returns:
+        str: path of zarr store
+
+    """
+    import zarr
+
+    if not isinstance(runs, dict):
+        runs = {None: runs}
+
+    for run, files in runs.items():
+        ds = open_run(files, grid, variables, verbose=verbose)
+
+        ds = ds.chunk(dict.fromkeys(ds.dims, -1))
+        chunked = {}
+        for name, var in ds.variables.items():
+            if "cell" in var.dims:
+                column_bytes = max(1, var.size // var.sizes["cell"] * var.dtype.itemsize)
+                cells = cell_chunk or max(1, chunk_bytes // column_bytes)
+                chunked[name] = var.chunk({"cell": cells})
+        ds = ds.assign_coords(
+            {name: var for name, var in chunked.items() if name in ds.coords}
+        ).assign({name: var for name, var in chunked.items() if name not in ds.coords})
+
+        # chunking of the netcdf files does not apply anymore
+        for var in ds.variables.values():
+            for key in ("chunks", "chunksizes", "preferred_chunks", "contiguous"):
+                var.encoding.pop(key, None)
+
+        ds.to_zarr(store, group=run, mode="w", consolidated=False)
+
+        if verbose:
+            print(f"Wrote run {run} to {store}.")
+
+    zarr.consolidate_metadata(store)
+
+    return store
+
 def add_encoding(obj):
     obj.encoding['coordinates'] = 'clat clon'
 
@@ -251,18 +1860,20 @@ def add_grid_info2(nc_file, grid_file, index_name_grid = 'cell', index_name_fcst
     """Add grid information to icon dataset.
 
     Adapt dim-names from grid and icon file accordingly.
+    The grid file is opened once per process (see load_grid).
 
     Args:
         nc_file (str): icon output file
         grid_file (str): icon grid file
     """
 
-    grid_ds = psy.open_dataset(grid_file)
-    icon_ds = psy.open_dataset(nc_file).squeeze()
+    grid_ds = load_grid(grid_file)["ds"]
+    icon_ds = decode_absolute_time(xr.open_dataset(nc_file)).squeeze()
 
-    data = icon_ds.rename({index_name_fcst: index_name_grid}).merge(grid_ds)
+    # copy, so encodings are not added to the shared grid dataset
+    data = icon_ds.rename({index_name_fcst: index_name_grid}).merge(grid_ds.copy())
 
     # clat clon encoding needs to be added for each variable
-    for k, v in six.iteritems(data.data_vars):
+    for k, v in data.data_vars.items():
         add_encoding(v)
     return data